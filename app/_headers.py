@@ -0,0 +1,13 @@
+# Lowercased names of headers seen on most requests, mapped to a shared str so
+# parsing them does not decode a fresh key every time. Both the pure Python
+# parser in app.main and the compiled one in app._parser intern through this.
+
+COMMON_HEADERS = {
+    b'host': 'host',
+    b'user-agent': 'user-agent',
+    b'accept': 'accept',
+    b'accept-encoding': 'accept-encoding',
+    b'content-type': 'content-type',
+    b'content-length': 'content-length',
+    b'connection': 'connection',
+}
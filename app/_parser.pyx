@@ -0,0 +1,119 @@
+# cython: language_level=3, boundscheck=False, wraparound=False
+#
+# C implementation of app.main._parse_request. Build it in place with
+#
+#     cythonize -i app/_parser.pyx
+#
+# and app.main picks it up automatically; without it the pure Python parser
+# is used. Both return the same (method, target, headers, body) tuple, which
+#
+#     python -m app.check_parser
+#
+# checks by fuzzing the two against each other.
+
+from cpython.bytes cimport PyBytes_AS_STRING, PyBytes_FromStringAndSize
+from cpython.dict cimport PyDict_SetItem
+from cpython.unicode cimport PyUnicode_DecodeLatin1
+from libc.string cimport memchr
+
+from app._headers import COMMON_HEADERS
+
+
+cdef enum:
+    LF = 10
+    CR = 13
+    SP = 32
+    COLON = 58
+
+
+# The same table app.main uses, so both parsers hand out the same str objects
+cdef dict _COMMON_HEADERS = COMMON_HEADERS
+
+
+cdef inline bint _is_space(char c) noexcept:
+    # Same set of separators bytes.split() uses
+    return c == SP or 9 <= c <= 13
+
+
+cdef Py_ssize_t _find_header_end(const char *buf, Py_ssize_t size) noexcept:
+    cdef const char *p = buf
+    cdef const char *end = buf + size
+    while end - p >= 4:
+        p = <const char *>memchr(p, CR, end - p - 3)
+        if p == NULL:
+            return -1
+        if p[1] == LF and p[2] == CR and p[3] == LF:
+            return p - buf
+        p += 1
+    return -1
+
+
+cpdef tuple parse_request(const unsigned char[::1] raw):
+    cdef Py_ssize_t size = raw.shape[0]
+    cdef const char *buf
+    cdef const char *nl
+    cdef char *kp
+    cdef char c
+    cdef Py_ssize_t header_end, body_start, line_start, line_end, next_start
+    cdef Py_ssize_t pos, start, colon, key_len, i
+    cdef dict headers = {}
+    cdef bytes method, target, key
+    cdef object name
+
+    if size == 0:
+        raise ValueError('empty request')
+    buf = <const char *>&raw[0]
+
+    header_end = _find_header_end(buf, size)
+    if header_end < 0:
+        header_end = size
+        body_start = size
+    else:
+        body_start = header_end + 4
+
+    # Request line: the first two whitespace separated tokens are the method and target
+    nl = <const char *>memchr(buf, LF, header_end)
+    line_end = header_end if nl == NULL else nl - buf
+    pos = 0
+    while pos < line_end and _is_space(buf[pos]):
+        pos += 1
+    start = pos
+    while pos < line_end and not _is_space(buf[pos]):
+        pos += 1
+    method = PyBytes_FromStringAndSize(<char *>buf + start, pos - start)
+    while pos < line_end and _is_space(buf[pos]):
+        pos += 1
+    start = pos
+    while pos < line_end and not _is_space(buf[pos]):
+        pos += 1
+    if pos == start:
+        raise ValueError('malformed request line')
+    target = PyBytes_FromStringAndSize(<char *>buf + start, pos - start)
+
+    # Header lines: split on the first b': ', lowercase the name in place
+    line_start = line_end + 1
+    while line_start < header_end:
+        nl = <const char *>memchr(buf + line_start, LF, header_end - line_start)
+        line_end = header_end if nl == NULL else nl - buf
+        next_start = line_end + 1
+        while line_end > line_start and buf[line_end - 1] == CR:
+            line_end -= 1
+
+        colon = line_start
+        while colon + 1 < line_end and not (buf[colon] == COLON and buf[colon + 1] == SP):
+            colon += 1
+        if colon + 1 < line_end:
+            key_len = colon - line_start
+            key = PyBytes_FromStringAndSize(NULL, key_len)
+            kp = PyBytes_AS_STRING(key)
+            for i in range(key_len):
+                c = buf[line_start + i]
+                kp[i] = c + 32 if 65 <= c <= 90 else c
+            name = _COMMON_HEADERS.get(key)
+            if name is None:
+                name = PyUnicode_DecodeLatin1(kp, key_len, NULL)
+            PyDict_SetItem(headers, name, PyBytes_FromStringAndSize(
+                <char *>buf + colon + 2, line_end - colon - 2))
+        line_start = next_start
+
+    return method, target, headers, PyBytes_FromStringAndSize(<char *>buf + body_start, size - body_start)
@@ -0,0 +1,141 @@
+# Minimal io_uring bindings over ctypes: just enough ring plumbing for the
+# server's accept / recv / send / read / close loop and its accept back-off
+# timer. IoUring() raises OSError when the kernel is older than 5.11 or
+# io_uring is blocked (Docker's default seccomp profile does), and the caller
+# falls back to asyncio.
+
+import ctypes
+import errno
+import mmap
+import os
+import platform
+import re
+import struct
+
+_NR_IO_URING_SETUP = 425
+_NR_IO_URING_ENTER = 426
+
+IORING_OP_TIMEOUT = 11
+IORING_OP_ACCEPT = 13
+IORING_OP_CLOSE = 19
+IORING_OP_READ = 22
+IORING_OP_SEND = 26
+IORING_OP_RECV = 27
+
+_IORING_ENTER_GETEVENTS = 1
+_IORING_FEAT_SINGLE_MMAP = 1
+_IORING_OFF_SQ_RING = 0
+_IORING_OFF_CQ_RING = 0x8000000
+_IORING_OFF_SQES = 0x10000000
+
+_MIN_KERNEL = (5, 11)
+
+# struct io_uring_sqe and struct io_uring_cqe
+_SQE = struct.Struct('<BBHiQQIIQHHiQQ')
+_CQE = struct.Struct('<QiI')
+
+_U32 = 0xffffffff
+
+
+def _kernel_version():
+    match = re.match(r'(\d+)\.(\d+)', platform.release())
+    return (int(match.group(1)), int(match.group(2))) if match else (0, 0)
+
+
+class IoUring:
+    def __init__(self, entries):
+        if platform.system() != 'Linux' or _kernel_version() < _MIN_KERNEL:
+            raise OSError(errno.ENOSYS, 'io_uring needs Linux 5.11 or newer')
+        self._syscall = ctypes.CDLL(None, use_errno=True).syscall
+        self._syscall.restype = ctypes.c_long
+
+        # struct io_uring_params is 30 u32s: 10 of setup fields, then the
+        # sq_off and cq_off offset blocks at 10 and 20
+        params = (ctypes.c_uint32 * 30)()
+        self.fd = self._syscall(ctypes.c_long(_NR_IO_URING_SETUP), ctypes.c_long(entries), params)
+        if self.fd < 0:
+            err = ctypes.get_errno()
+            raise OSError(err, os.strerror(err))
+
+        sq_entries, cq_entries, features = params[0], params[1], params[5]
+        sq_size = params[16] + sq_entries * 4
+        cq_size = params[25] + cq_entries * _CQE.size
+        prot = mmap.PROT_READ | mmap.PROT_WRITE
+        flags = mmap.MAP_SHARED | mmap.MAP_POPULATE
+        if features & _IORING_FEAT_SINGLE_MMAP:
+            self._sq_ring = self._cq_ring = mmap.mmap(
+                self.fd, max(sq_size, cq_size), flags, prot, offset=_IORING_OFF_SQ_RING)
+        else:
+            self._sq_ring = mmap.mmap(self.fd, sq_size, flags, prot, offset=_IORING_OFF_SQ_RING)
+            self._cq_ring = mmap.mmap(self.fd, cq_size, flags, prot, offset=_IORING_OFF_CQ_RING)
+        self._sqes = mmap.mmap(self.fd, sq_entries * _SQE.size, flags, prot, offset=_IORING_OFF_SQES)
+
+        # Ring indices are u32 fields, so address the rings as u32 arrays
+        self._sq = memoryview(self._sq_ring).cast('I')
+        self._cq = memoryview(self._cq_ring).cast('I')
+        self._sq_entries = sq_entries
+        self._sq_head = params[10] // 4
+        self._sq_tail = params[11] // 4
+        self._sq_mask = self._sq[params[12] // 4]
+        self._cq_head = params[20] // 4
+        self._cq_tail = params[21] // 4
+        self._cq_mask = self._cq[params[22] // 4]
+        self._cqes = params[25]
+        # SQE slot i always sits at index i of the submission array
+        array = params[16] // 4
+        for i in range(sq_entries):
+            self._sq[array + i] = i
+
+    def prep(self, opcode, fd, addr=0, length=0, offset=0, op_flags=0, user_data=0):
+        sq = self._sq
+        tail = sq[self._sq_tail]
+        if (tail - sq[self._sq_head]) & _U32 == self._sq_entries:
+            # Submission ring is full, hand what is queued over first
+            self.submit()
+            if (tail - sq[self._sq_head]) & _U32 == self._sq_entries:
+                raise OSError(errno.EBUSY, 'io_uring submission queue is full')
+        _SQE.pack_into(self._sqes, (tail & self._sq_mask) * _SQE.size,
+                       opcode, 0, 0, fd, offset, addr, length, op_flags, user_data, 0, 0, 0, 0, 0)
+        sq[self._sq_tail] = (tail + 1) & _U32
+
+    def submit(self, wait_nr=0):
+        # Submits everything queued since the last call and, with wait_nr,
+        # blocks until that many completions are ready, all in one syscall
+        while True:
+            to_submit = (self._sq[self._sq_tail] - self._sq[self._sq_head]) & _U32
+            ret = self._syscall(
+                ctypes.c_long(_NR_IO_URING_ENTER), ctypes.c_long(self.fd), ctypes.c_long(to_submit),
+                ctypes.c_long(wait_nr), ctypes.c_long(_IORING_ENTER_GETEVENTS if wait_nr else 0),
+                None, ctypes.c_long(0))
+            if ret >= 0:
+                return ret
+            err = ctypes.get_errno()
+            if err == errno.EINTR:
+                continue
+            if err in (errno.EAGAIN, errno.EBUSY):
+                # Completion queue is backed up; the caller reaps and calls again
+                return 0
+            raise OSError(err, os.strerror(err))
+
+    def completions(self):
+        # Drains every ready CQE as (user_data, res) pairs; the head is moved
+        # before returning so callbacks are free to queue new SQEs
+        cq = self._cq
+        head = cq[self._cq_head]
+        tail = cq[self._cq_tail]
+        ready = []
+        while head != tail:
+            user_data, res, _ = _CQE.unpack_from(self._cq_ring, self._cqes + (head & self._cq_mask) * _CQE.size)
+            ready.append((user_data, res))
+            head = (head + 1) & _U32
+        cq[self._cq_head] = head
+        return ready
+
+    def close(self):
+        self._sq.release()
+        self._cq.release()
+        self._sqes.close()
+        self._sq_ring.close()
+        if self._cq_ring is not self._sq_ring:
+            self._cq_ring.close()
+        os.close(self.fd)